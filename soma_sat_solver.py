@@ -1,10 +1,9 @@
 import sys
 import time
 import numpy as np
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-from collections import defaultdict
-from pysat.solvers import Minisat22
+from pysat.card import CardEnc, EncType
+from pysat.formula import CNF
+from pysat.solvers import Solver
 
 
 z = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (2, 1, 0)]   
@@ -18,114 +17,219 @@ v = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
 pieces = [z, p, t, b, a, l, v]
 colors = ["blue", "red", "purple", "brown", "yellow", "orange", "green"]
 
-rotate_x = lambda cubelets: [(x, z, -y) for (x, y, z) in cubelets]
-rotate_y = lambda cubelets: [(z, y, -x) for (x, y, z) in cubelets]
-rotate_z = lambda cubelets: [(-y, x, z) for (x, y, z) in cubelets]
-identity  = lambda cubelets: cubelets
+# Count solutions with Algorithm X (True) or by SAT enumeration with blocking clauses (False).
+COUNT_WITH_DLX = True
+# PySAT solver used for SAT enumeration, e.g. "cadical153", "minicard" or "minisat22".
+SAT_SOLVER = "cadical153"
+# If set, write the CNF in DIMACS form to this path so external solvers can be run on it.
+DIMACS_FILE = None
+
+# Quarter turns about the x and y axes as row-major 3x3 matrices:
+# rotation_x maps (x, y, z) -> (x, z, -y), rotation_y maps (x, y, z) -> (z, y, -x).
+rotation_x = (1, 0, 0, 0, 0, 1, 0, -1, 0)
+rotation_y = (0, 0, 1, 0, 1, 0, -1, 0, 0)
+identity = (1, 0, 0, 0, 1, 0, 0, 0, 1)
+
+def compose(m, n):
+    """Return the matrix product m * n of two row-major 3x3 matrices."""
+    return tuple(sum(m[3 * i + k] * n[3 * k + j] for k in range(3))
+                 for i in range(3) for j in range(3))
+
+def generate_rotation_group():
+    """Generate the 24 proper rotations of the cube as the closure of {rotation_x, rotation_y}."""
+    group = {identity}
+    frontier = [identity]
+    while frontier:
+        m = frontier.pop()
+        for generator in (rotation_x, rotation_y):
+            r = compose(generator, m)
+            if r not in group:
+                group.add(r)
+                frontier.append(r)
+    return sorted(group)
+
+rotations = generate_rotation_group()
+rotation_matrices = np.array(rotations, dtype=np.int8).reshape(-1, 3, 3)
+# Bit index of cell (x, y, z) in a placement bitmask is 9x + 3y + z.
+cell_strides = np.array([9, 3, 1], dtype=np.int64)
+
+def cell_index(cell):
+    """Return the bit index 9x + 3y + z of a cube cell."""
+    return 9 * cell[0] + 3 * cell[1] + cell[2]
+
+def cells_of(bits):
+    """Decode a 27-bit placement mask into its list of (x, y, z) cells, in sorted order."""
+    cells = []
+    while bits:
+        low = bits & -bits
+        idx = low.bit_length() - 1
+        cells.append((idx // 9, idx // 3 % 3, idx % 3))
+        bits ^= low
+    return cells
 
 def generate_rotations(piece):
-    """Generate all unique rotations of a piece (ignoring reflections)."""
-    orientations = []
-    for f_a in [identity, rotate_x, rotate_y, rotate_z]:
-        for f_b in [identity, rotate_x, rotate_y, rotate_z]:
-            for f_c in [identity, rotate_x, rotate_y, rotate_z]:
-                for f_d in [identity, rotate_x, rotate_y, rotate_z]:
-                    for f_e in [identity, rotate_x, rotate_y, rotate_z]:
-                        rot_piece = f_a(f_b(f_c(f_d(f_e(piece)))))
-                        rot_piece_sorted = sorted(rot_piece)
-                        min_x, min_y, min_z = rot_piece_sorted[0]
-                        trans_rot_piece = tuple((x - min_x, y - min_y, z - min_z)
-                                                 for (x, y, z) in rot_piece_sorted)
-                        if trans_rot_piece not in orientations:
-                            orientations.append(trans_rot_piece)
-    return orientations
+    """
+    Generate all unique rotations of a piece (ignoring reflections).
+    All 24 rotation matrices are applied in one matrix product, each rotated copy
+    is shifted to the origin, and copies are deduplicated on their cell mask.
+    """
+    cells = np.array(piece, dtype=np.int8)  # (cell, xyz)
+    rotated = rotation_matrices[:, None, :, :] @ cells[None, :, :, None]  # (rotation, cell, xyz, 1)
+    rotated = rotated[..., 0]
+    rotated -= rotated.min(axis=1, keepdims=True)
+    bits = np.left_shift(np.int64(1), rotated @ cell_strides).sum(axis=1)
+    return sorted(tuple(cells_of(orientation_bits)) for orientation_bits in np.unique(bits).tolist())
 
+# Distinct orientations per piece: p (the tripod) has 8, l has 24 and the others,
+# including the planar v, have 12; each count is 24 divided by the number of rotations
+# mapping the piece onto itself. Mirror images are never merged: a and b are each
+# other's reflection and must stay distinct pieces.
 orientations = [generate_rotations(piece) for piece in pieces]
 coordinates = [(x, y, z) for x in range(3) for y in range(3) for z in range(3)]
+anchors = np.array(coordinates, dtype=np.int8)
+axis_coords = np.arange(3, dtype=np.int8)
 
 def generate_placements():
     """
     Enumerate every valid placement.
     
-    A placement is a tuple (piece, adjusted_orientation), where adjusted_orientation is
-    a tuple of cube cells that the piece occupies when placed.
+    A placement is a tuple (piece, bits), where bits is a 27-bit mask of the cube
+    cells that the piece occupies when placed (bit 9x + 3y + z for cell (x, y, z)).
     
     Each placement is assigned a unique Boolean variable number.
     
     In addition, we record a name for each variable of the form P_{xyzi}:
       - (x,y,z) is the anchor coordinate (converted to 1-indexed),
       - i is the piece number (from 1 to 7).
+    
+    For each (orientation, base cell) of a piece, the anchors that keep the piece
+    inside the cube form a sub-box, found per axis from the bounding box of the
+    orientation's offsets from the base cell. The cells are computed only for the
+    anchors in these sub-boxes, and duplicates are removed with np.unique on a
+    27-bit cell mask.
       
     Returns:
-      - placements: dict mapping (piece, adjusted_orientation) -> variable id
+      - placements: dict mapping (piece, bits) -> variable id
       - placements_by_piece: dict mapping piece index -> set of variable ids
-      - placements_by_cell: dict mapping cube cell -> set of variable ids
+      - placements_by_cell: list of 27 sets of variable ids, indexed by cell bit index
       - var_names: dict mapping variable id -> variable name (like P_{1213})
       - num_vars: total number of variables (placements)
     """
-    placements = {}  # mapping (piece, adjusted_orientation) -> variable id
+    placements = {}  # mapping (piece, bits) -> variable id
     placements_by_piece = {i: set() for i in range(7)}
-    placements_by_cell = defaultdict(set)
+    placements_by_cell = [set() for _ in range(27)]
     var_names = {}  # mapping variable id -> name string (like P_{xyzi})
     var_counter = 1
 
-    for anchor in coordinates:
-        for piece in range(7):
-            for orient in orientations[piece]:
-                for base in orient:
-                    adjusted = tuple(sorted(
-                        ((anchor[0] + o[0] - base[0],
-                          anchor[1] + o[1] - base[1],
-                          anchor[2] + o[2] - base[2])
-                         for o in orient)
-                    ))
-                    if all(0 <= cell[0] < 3 and 0 <= cell[1] < 3 and 0 <= cell[2] < 3 for cell in adjusted):
-                        placement_key = (piece, adjusted)
-                        if placement_key not in placements:
-                            placements[placement_key] = var_counter
-                            # Use the current anchor (converted to 1-indexed) and piece id+1
-                            ax, ay, az = anchor[0] + 1, anchor[1] + 1, anchor[2] + 1
-                            var_names[var_counter] = f"P_{{{ax}{ay}{az}{piece+1}}}"
-                            var_counter += 1
-                        var = placements[placement_key]
-                        placements_by_piece[piece].add(var)
-                        for cell in adjusted:
-                            placements_by_cell[cell].add(var)
+    for piece in range(7):
+        orients = np.array(orientations[piece], dtype=np.int8)  # (orientation, cell, xyz)
+        # offsets[orientation, base, cell] = cell - base
+        offsets = orients[:, None, :, :] - orients[:, :, None, :]
+        low = offsets.min(axis=2)  # (orientation, base, xyz)
+        high = offsets.max(axis=2)
+        # Along each axis the valid anchor coordinates are -low .. 2 - high.
+        in_range = ((axis_coords >= -low[..., None])
+                    & (axis_coords <= 2 - high[..., None]))  # (orientation, base, xyz, coord)
+        box = (in_range[:, :, 0, :, None, None]
+               & in_range[:, :, 1, None, :, None]
+               & in_range[:, :, 2, None, None, :])  # (orientation, base, x, y, z)
+        # Anchors are numbered 9x + 3y + z, so flattening the box indexes them directly.
+        valid = box.reshape(*box.shape[:2], 27).transpose(2, 0, 1)
+        anchor_idx, orient_idx, base_idx = np.nonzero(valid)  # ordered by anchor first
+        shifted = anchors[anchor_idx, None, :] + offsets[orient_idx, base_idx]  # (shift, cell, xyz)
+        bits = np.left_shift(np.int64(1), shifted @ cell_strides).sum(axis=1)
+        _, first = np.unique(bits, return_index=True)
+        for placement_bits in bits[np.sort(first)].tolist():
+            var = var_counter
+            placements[(piece, placement_bits)] = var
+            # The anchor is the lowest cell, i.e. the lowest set bit.
+            ax, ay, az = cells_of(placement_bits & -placement_bits)[0]
+            var_names[var] = f"P_{{{ax+1}{ay+1}{az+1}{piece+1}}}"
+            var_counter += 1
+            placements_by_piece[piece].add(var)
+            rest = placement_bits
+            while rest:
+                low = rest & -rest
+                placements_by_cell[low.bit_length() - 1].add(var)
+                rest ^= low
     return placements, placements_by_piece, placements_by_cell, var_names, var_counter - 1
 
 def exactly_one(variables):
     """
-    Produce CNF clauses for the "exactly one" constraint:
+    Produce CNF clauses for the "exactly one" constraint with PySAT's CardEnc:
       - At least one literal is true.
       - At most one literal is true (pairwise).
     Returns a list of clauses.
     """
-    clauses = []
     # Convert to list to preserve order (although order is not important logically)
     variables = list(variables)
     if not variables:
-        return clauses
-    clauses.append(variables)  # at least one clause
-    for i in range(len(variables)):
-        for j in range(i + 1, len(variables)):
-            clauses.append([-variables[i], -variables[j]])
-    return clauses
+        return []
+    return CardEnc.equals(lits=variables, bound=1, encoding=EncType.pairwise).clauses
 
 def generate_sat_instance():
+    """
+    Build the CNF instance.
+
+    Returns:
+      - placements: dict mapping (piece, bits) -> variable id
+      - clauses: list of CNF clauses
+      - num_vars: total number of variables (placements)
+      - var_names: dict mapping variable id -> variable name
+      - constraints: list of the variable lists that must each have exactly one true
+        variable, for solvers with native cardinality constraints
+    """
     placements, placements_by_piece, placements_by_cell, var_names, num_vars = generate_placements()
     clauses = []
+    constraints = []
     # Constraint: Each piece is placed exactly once.
     for piece in placements_by_piece:
         piece_vars = list(placements_by_piece[piece])
         clauses.extend(exactly_one(piece_vars))
+        constraints.append(piece_vars)
     # Constraint: Each cube cell is covered exactly once.
-    for cell in placements_by_cell:
-        cell_vars = list(placements_by_cell[cell])
+    for cell_vars in placements_by_cell:
+        cell_vars = list(cell_vars)
         clauses.extend(exactly_one(cell_vars))
-    return placements, clauses, num_vars, var_names
+        constraints.append(cell_vars)
+    return placements, clauses, num_vars, var_names, constraints
+
+def rotate_cell(m, cell):
+    """Rotate a cube cell by the row-major 3x3 matrix m about the centre cell (1, 1, 1)."""
+    x, y, z = cell[0] - 1, cell[1] - 1, cell[2] - 1
+    return (m[0] * x + m[1] * y + m[2] * z + 1,
+            m[3] * x + m[4] * y + m[5] * z + 1,
+            m[6] * x + m[7] * y + m[8] * z + 1)
+
+def symmetry_breaking_clauses(placements, piece=6):
+    """
+    Break the 24-fold rotational symmetry of the cube by restricting one piece (by
+    default the v tricube) to a single representative placement per orbit of the
+    rotation group. The representative is the image with the smallest cell mask.
+    
+    Returns:
+      - clauses: unit clauses forbidding every non-representative placement of the piece
+      - stabilizers: dict mapping each representative variable id -> number of
+        rotations that fix that placement
+    """
+    clauses = []
+    stabilizers = {}
+    for (p, bits), var in placements.items():
+        if p != piece:
+            continue
+        cells = cells_of(bits)
+        images = [sum(1 << cell_index(rotate_cell(m, cell)) for cell in cells) for m in rotations]
+        if bits == min(images):
+            stabilizers[var] = images.count(bits)
+        else:
+            clauses.append([-var])
+    return clauses, stabilizers
 
 # Generate the SAT instance.
-placements, clauses, num_vars, var_names = generate_sat_instance()
+placements, clauses, num_vars, var_names, constraints = generate_sat_instance()
+if DIMACS_FILE is not None:
+    CNF(from_clauses=clauses).to_file(DIMACS_FILE)
+symmetry_clauses, stabilizers = symmetry_breaking_clauses(placements)
 
 # --- Print a Portion of the Formula in LaTeX (with duplicate literals removed) ---
 def print_formula_portion(clauses, var_names):
@@ -143,12 +247,7 @@ def print_formula_portion(clauses, var_names):
         original_length = len(clause)
         if original_length in smallest_widths and original_length not in printed:
             # Remove duplicate literals while preserving the original order.
-            unique_clause = []
-            seen = set()
-            for lit in clause:
-                if lit not in seen:
-                    unique_clause.append(lit)
-                    seen.add(lit)
+            unique_clause = dict.fromkeys(clause)
             # Create LaTeX strings for each literal.
             lit_strs = []
             for lit in unique_clause:
@@ -159,6 +258,8 @@ def print_formula_portion(clauses, var_names):
             # Build the clause string with the LaTeX disjunction operator.
             clause_str = "(" + " \\vee ".join(lit_strs) + ")"
             printed[original_length] = clause_str
+            if len(printed) == len(smallest_widths):
+                break
 
     # Print the overall formula with a representative clause for each selected width.
     print("Puzzle: Find an assignment of truth values (0's and 1's) to all the $P_{xyzi}$ variables such that the entire formula $\\Phi$ evaluates to true (1).")
@@ -175,16 +276,30 @@ def print_formula_portion(clauses, var_names):
 print_formula_portion(clauses, var_names)
 
 # --- Model Counting with Progress Tracker ---
-def count_solutions(clauses, num_vars):
+def count_solutions(clauses, constraints, symmetry_clauses, num_placement_vars, solver_name=SAT_SOLVER):
     """
-    Enumerate all solutions of the CNF instance using a blocking clause method.
+    Enumerate all solutions using a blocking clause method, subject to the
+    symmetry-breaking clauses.
+    Solvers with native cardinality constraints (such as Minicard) are given each
+    exactly-one constraint as an at-least-one clause plus a native at-most-one
+    constraint; other solvers (such as CaDiCaL) are given the pairwise CNF clauses.
+    A solution is determined by its seven chosen placements, so it is blocked by
+    negating just the true placement variables among 1..num_placement_vars.
     Prints a progress update each time a solution is found.
     
     Returns:
       - solution_count: total number of solutions found.
       - models: list of models.
     """
-    solver = Minisat22(bootstrap_with=clauses)
+    solver = Solver(name=solver_name)
+    if solver.supports_atmost():
+        for variables in constraints:
+            solver.add_clause(variables)
+            solver.add_atmost(variables, 1)
+    else:
+        solver.append_formula(clauses)
+    for clause in symmetry_clauses:
+        solver.add_clause(clause)
     solution_count = 0
     models = []
     while solver.solve():
@@ -194,14 +309,85 @@ def count_solutions(clauses, num_vars):
         sys.stdout.write(f"\rSolutions found so far: {solution_count}")
         sys.stdout.flush()
         # Block the current solution.
-        blocking_clause = [-lit for lit in model]
+        blocking_clause = [-lit for lit in model[:num_placement_vars] if lit > 0]
         solver.add_clause(blocking_clause)
     print()  # Newline after progress updates.
     solver.delete()
     return solution_count, models
 
-solution_count, models = count_solutions(clauses, num_vars)
-print("Total number of solutions found:", solution_count)
+def count_exact_covers(placements, symmetry_clauses):
+    """
+    Enumerate all solutions as exact covers with Knuth's Algorithm X, keeping the
+    columns as a dict of sets in place of dancing links.
+    Each placement is a row covering its cells (columns 0..26, by bit index) and
+    its piece (columns 27..33). Placements forbidden by the unit symmetry-breaking
+    clauses are left out.
+    Prints a progress update each time a solution is found.
+    
+    Returns:
+      - solution_count: total number of solutions found.
+      - models: list of solutions, each a list of the chosen placement variable ids.
+    """
+    excluded = {-clause[0] for clause in symmetry_clauses}
+    rows = {}  # variable id -> list of columns it covers
+    for (piece, bits), var in placements.items():
+        if var not in excluded:
+            rows[var] = [idx for idx in range(27) if bits >> idx & 1] + [27 + piece]
+    columns = {col: set() for col in range(34)}  # column -> rows covering it
+    for var, cols in rows.items():
+        for col in cols:
+            columns[col].add(var)
+
+    def select(var):
+        removed = []
+        for col in rows[var]:
+            for other in columns[col]:
+                for other_col in rows[other]:
+                    if other_col != col:
+                        columns[other_col].remove(other)
+            removed.append(columns.pop(col))
+        return removed
+
+    def deselect(var, removed):
+        for col in reversed(rows[var]):
+            columns[col] = removed.pop()
+            for other in columns[col]:
+                for other_col in rows[other]:
+                    if other_col != col:
+                        columns[other_col].add(other)
+
+    models = []
+    partial = []
+
+    def search():
+        if not columns:
+            models.append(list(partial))
+            sys.stdout.write(f"\rSolutions found so far: {len(models)}")
+            sys.stdout.flush()
+            return
+        # Branch on the column with the fewest candidate rows.
+        col = min(columns, key=lambda c: len(columns[c]))
+        for var in sorted(columns[col]):
+            partial.append(var)
+            removed = select(var)
+            search()
+            deselect(var, removed)
+            partial.pop()
+
+    search()
+    print()  # Newline after progress updates.
+    return len(models), models
+
+if COUNT_WITH_DLX:
+    solution_count, models = count_exact_covers(placements, symmetry_clauses)
+else:
+    solution_count, models = count_solutions(clauses, constraints, symmetry_clauses, len(placements))
+# A rotation class whose v placement is fixed by k rotations is found k times,
+# so each found solution stands for 24 / k solutions of the unrestricted instance.
+total_count = sum(len(rotations) // stabilizers[lit] for model in models
+                  for lit in model if lit in stabilizers)
+print("Number of solutions up to rotation:", total_count // len(rotations))
+print("Total number of solutions found:", total_count)
 
 # --- Reconstruct One Solution ---
 if solution_count == 0:
@@ -209,11 +395,13 @@ if solution_count == 0:
     exit()
 else:
     chosen_model = models[0]
+    placement_of = {var: key for key, var in placements.items()}  # variable id -> (piece, bits)
     # Mark the cells covered by each placement in the chosen solution.
     solution_cells = {}  # maps each cube cell (x, y, z) to a piece color
-    for (piece, adjusted), var in placements.items():
-        if var in chosen_model:  # placement is selected (variable is true)
-            for cell in adjusted:
+    for lit in chosen_model:
+        if lit in placement_of:  # placement is selected (variable is true)
+            piece, bits = placement_of[lit]
+            for cell in cells_of(bits):
                 solution_cells[cell] = colors[piece]
     
     # Prepare the list for plotting: each element is (x, y, z, color)
@@ -226,6 +414,9 @@ def plot_solution(solution):
     Plot a 3D visualization of the Soma cube solution.
     Each cell in the 3x3x3 cube is drawn as a colored cube.
     """
+    # Imported here so that runs which only count solutions don't pay for matplotlib.
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d import Axes3D
     fig = plt.figure()
     ax = fig.add_subplot(111, projection='3d')
     color_map = {